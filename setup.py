@@ -11,7 +11,8 @@ setup(
     package_dir={'': 'src'},
     install_requires=[
         'docker>=7.0.0',
-        'rich>=13.0.0'
+        'rich>=13.0.0',
+        'zstandard>=0.22.0'
     ],
     entry_points={
         'console_scripts': [
@@ -1,65 +1,419 @@
+import codecs
+import hashlib
+import io
+import json
 import os
-import subprocess
+import tarfile
+import tempfile
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Iterable, Iterator, BinaryIO, Set, Tuple
 
-from docker import from_env as docker_from_env
-from docker.errors import DockerException
+import zstandard as zstd
+from docker import DockerClient, from_env as docker_from_env
+from docker.errors import DockerException, ImageNotFound
 from rich.console import Console
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_IO_CHUNK_SIZE = 1 << 20
+_LOG_BUFFER_SIZE = 64 * 1024
+_LOG_FLUSH_INTERVAL = 0.05
+_MANIFEST_NAME = "index.json"
+_MANIFEST_LOCK_NAME = "index.lock"
+_IMAGE_SUFFIX = ".tar.zst"
+_LEGACY_IMAGE_SUFFIX = ".tar"
+_IMAGE_FILE_FORMAT = "{lang}-{name}-{version}{suffix}"
+_ZSTD_LEVEL = 3
+_BUILD_STAGE = "build"
+
+_SHARED_CLIENT: Optional[DockerClient] = None
+_SHARED_CLIENT_LOCK = threading.Lock()
+
+
+def _get_client() -> DockerClient:
+    """Return the process-wide Docker client, creating it on first use."""
+    global _SHARED_CLIENT
+    if _SHARED_CLIENT is None:
+        with _SHARED_CLIENT_LOCK:
+            if _SHARED_CLIENT is None:
+                _SHARED_CLIENT = docker_from_env()
+    return _SHARED_CLIENT
+
+
+@lru_cache(maxsize=256)
+def _image_path_str(base_dir: str, lang: str, name: str, version: str, suffix: str = _IMAGE_SUFFIX) -> str:
+    """Return the image file path for an environment as a plain string."""
+    return os.path.join(base_dir, _IMAGE_FILE_FORMAT.format(lang=lang, name=name, version=version, suffix=suffix))
+
+
+def _lock_file(lock_file: BinaryIO) -> None:
+    """Block until an exclusive lock on the file is held."""
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+
+    # msvcrt locks a byte range and LK_LOCK gives up after ~10s, so keep retrying
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(lock_file: BinaryIO) -> None:
+    """Release a lock taken with _lock_file."""
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class _DigestWriter:
+    """Write-through file wrapper that feeds every byte into a hashlib digest."""
+
+    def __init__(self, file: BinaryIO, digest: Any):
+        self._file = file
+        self._digest = digest
+
+    def write(self, data: bytes) -> int:
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
 
 class EnvironmentManager(ABC):
     """Base class for environment management with Docker."""
 
+    _RESOLVED_BASE_DIRS: Dict[str, Path] = {}
+    _BASE_DIR_READY: Set[Path] = set()
+    _MANIFEST_CACHE: Dict[Path, Tuple[int, Dict[str, Dict[str, str]]]] = {}
+
     def __init__(
             self,
             base_dir: str = "~/.kosher/environments",
             container_dir: str = "/app",
     ):
         self._lang = None
-        self._base_dir = Path(os.path.expanduser(base_dir))
+        self._base_dir = self._resolve_base_dir(base_dir)
+        self._base_dir_str = str(self._base_dir)
         self._container_dir = container_dir
         self.image_prefix = "kosher"
-        self._client = docker_from_env()
+        self._client = _get_client()
         self._console = Console()
-        self._base_dir.mkdir(parents=True, exist_ok=True)
 
-    def _get_image_path(self, name: str, version: str) -> Path:
-        """Get the path where the image tar should be stored."""
-        return self._base_dir / f"{self._lang}-{name}-{version}.tar"
+    @classmethod
+    def _resolve_base_dir(cls, base_dir: str) -> Path:
+        """Expand and create the environments directory once per process."""
+        path = cls._RESOLVED_BASE_DIRS.get(base_dir)
+        if path is None:
+            path = Path(os.path.expanduser(base_dir))
+            cls._RESOLVED_BASE_DIRS[base_dir] = path
+
+        if path not in cls._BASE_DIR_READY:
+            path.mkdir(parents=True, exist_ok=True)
+            cls._BASE_DIR_READY.add(path)
+
+        return path
+
+    def _get_image_path(self, name: str, version: str, suffix: str = _IMAGE_SUFFIX) -> Path:
+        """Get the path where the compressed image tar should be stored."""
+        return Path(_image_path_str(self._base_dir_str, self._lang, name, version, suffix))
+
+    def _find_image_file(self, name: str, version: str) -> Optional[Path]:
+        """Return the saved image file, falling back to an uncompressed legacy tar."""
+        for suffix in (_IMAGE_SUFFIX, _LEGACY_IMAGE_SUFFIX):
+            image_path = _image_path_str(self._base_dir_str, self._lang, name, version, suffix)
+            if os.path.exists(image_path):
+                return Path(image_path)
+        return None
 
     def _save_image(self, image_name: str, name: str, version: str) -> bool:
-        """Save Docker image as tar file in environments directory."""
+        """Save Docker image as zstd-compressed tar file in environments directory."""
         image_path = self._get_image_path(name, version)
         try:
             image = self._client.images.get(image_name)
-            with open(image_path, 'wb') as f:
-                for chunk in image.save():
-                    f.write(chunk)
+            digest = hashlib.sha256()
+            compressor = zstd.ZstdCompressor(level=_ZSTD_LEVEL, threads=-1)
+
+            # Stream into a temporary file so an interrupted save never leaves a
+            # truncated image where _find_image_file would pick it up
+            fd, tmp_path = tempfile.mkstemp(dir=self._base_dir, prefix=f"{image_path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb', buffering=_IO_CHUNK_SIZE) as f:
+                    with compressor.stream_writer(_DigestWriter(f, digest), closefd=False) as writer:
+                        for chunk in image.save(chunk_size=_IO_CHUNK_SIZE):
+                            writer.write(chunk)
+                os.replace(tmp_path, image_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+            self._update_manifest(name, version, image_path, digest.hexdigest())
             self._console.print(f"[green]Successfully saved image: {image_name} at {image_path}[/green]")
             return True
-        except DockerException as e:
+        except (DockerException, OSError, zstd.ZstdError) as e:
             self._console.print(f"[red]Error saving image: {str(e)}[/red]")
             return False
 
+    @property
+    def _manifest_path(self) -> Path:
+        return self._base_dir / _MANIFEST_NAME
+
+    @contextmanager
+    def _manifest_lock(self) -> Iterator[None]:
+        """Hold an exclusive cross-process lock while the index is read and rewritten."""
+        with open(self._base_dir / _MANIFEST_LOCK_NAME, 'a+b') as lock_file:
+            _lock_file(lock_file)
+            try:
+                yield
+            finally:
+                _unlock_file(lock_file)
+
+    def _read_manifest(self) -> Dict[str, Dict[str, str]]:
+        """Load the environment index, resyncing it when the directory has changed."""
+        manifest_path = self._manifest_path
+        try:
+            mtime = manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        # The index is stamped with the directory mtime on every write, so a newer
+        # directory means image files were added or removed behind its back
+        if mtime is None or self._base_dir.stat().st_mtime_ns > mtime:
+            return self._resync_manifest()
+
+        cached = self._MANIFEST_CACHE.get(manifest_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        entries = self._load_manifest()
+        if entries is None:
+            return self._resync_manifest()
+
+        self._MANIFEST_CACHE[manifest_path] = (mtime, entries)
+        return entries
+
+    def _resync_manifest(self) -> Dict[str, Dict[str, str]]:
+        """Reconcile the index with the directory under the lock and persist it."""
+        try:
+            with self._manifest_lock():
+                entries = self._sync_manifest(self._load_manifest())
+                self._write_manifest(entries)
+                return entries
+        except OSError:
+            # Read-only environments directory: serve the reconciled view without
+            # persisting it
+            return self._sync_manifest(self._load_manifest())
+
+    def _load_manifest(self) -> Optional[Dict[str, Dict[str, str]]]:
+        """Parse index.json, returning None when it is missing or unreadable."""
+        try:
+            return json.loads(self._manifest_path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self._console.print(f"[yellow]Rebuilding unreadable environment index: {str(e)}[/yellow]")
+            return None
+
+    def _write_manifest(self, entries: Dict[str, Dict[str, str]]) -> None:
+        """Atomically replace the environment index; the caller holds the manifest lock."""
+        manifest_path = self._manifest_path
+        fd, tmp_path = tempfile.mkstemp(dir=self._base_dir, prefix=f"{_MANIFEST_NAME}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, manifest_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        dir_mtime = self._base_dir.stat().st_mtime_ns
+        os.utime(manifest_path, ns=(dir_mtime, dir_mtime))
+        self._MANIFEST_CACHE[manifest_path] = (dir_mtime, entries)
+
+    def _sync_manifest(self, entries: Optional[Dict[str, Dict[str, str]]]) -> Dict[str, Dict[str, str]]:
+        """Reconcile index entries with the image files actually on disk."""
+        entries = entries or {}
+        files = {
+            file for file in os.listdir(self._base_dir)
+            if file.endswith(_IMAGE_SUFFIX) or file.endswith(_LEGACY_IMAGE_SUFFIX)
+        }
+
+        synced = {file: entry for file, entry in entries.items() if file in files}
+        for file in files - synced.keys():
+            entry = self._parse_environment_file(file)
+            if entry is not None:
+                synced[file] = entry
+
+        return synced
+
+    @staticmethod
+    def _parse_environment_file(file: str) -> Optional[Dict[str, str]]:
+        """Build a manifest entry from a `<lang>-<name>-<version>.tar[.zst]` file name."""
+        stem = file.removesuffix(_IMAGE_SUFFIX).removesuffix(_LEGACY_IMAGE_SUFFIX)
+        parts = stem.split('-')
+        if len(parts) < 3:
+            return None
+
+        return {
+            'lang': parts[0],
+            'name': '-'.join(parts[1:-1]),
+            'version': parts[-1],
+            'file': file,
+            # Hashing every image just to list them is too costly; only
+            # _save_image records a checksum, computed while writing
+            'sha256': ''
+        }
+
+    def _update_manifest(self, name: str, version: str, image_path: Path, sha256: str) -> None:
+        """Record a freshly saved environment in the index."""
+        with self._manifest_lock():
+            entries = self._sync_manifest(self._load_manifest())
+            entries[image_path.name] = {
+                'lang': self._lang,
+                'name': name,
+                'version': version,
+                'file': image_path.name,
+                'sha256': sha256
+            }
+            self._write_manifest(entries)
+
+    def _find_environments(self, name: str, lang: str) -> List[Dict[str, str]]:
+        """Return the manifest entries for every version of an environment."""
+        return [
+            entry for entry in self._read_manifest().values()
+            if entry['lang'] == lang and entry['name'] == name
+        ]
+
     def _load_image(self, name: str, version: str) -> Optional[str]:
         """Load Docker image from tar file and return image name."""
-        image_path = self._get_image_path(name, version)
-        if not image_path.exists():
-            self._console.print(f"[yellow]Image file not found: {image_path}[/yellow]")
+        image_path = self._find_image_file(name, version)
+        if image_path is None:
+            self._console.print(f"[yellow]Image file not found: {self._get_image_path(name, version)}[/yellow]")
             return None
 
         try:
             with open(image_path, 'rb') as f:
-                self._client.images.load(f.read())
+                if image_path.name.endswith(_IMAGE_SUFFIX):
+                    with zstd.ZstdDecompressor().stream_reader(f) as reader:
+                        self._client.images.load(iter(partial(reader.read, _IO_CHUNK_SIZE), b""))
+                else:
+                    self._client.images.load(f)
             image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
             self._console.print(f"[green]Successfully loaded image: {image_name}[/green]")
             return image_name
-        except DockerException as e:
+        except (DockerException, OSError, zstd.ZstdError) as e:
             self._console.print(f"[red]Error loading image: {str(e)}[/red]")
             return None
 
+    def _stream_logs(self, logs: Iterable[bytes]) -> None:
+        """Write container output to the console in batches, bypassing Rich rendering."""
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        out = self._console.file
+        buffer = bytearray()
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def flush(final: bool = False) -> None:
+            with lock:
+                text = decoder.decode(buffer, final=final)
+                buffer.clear()
+                if text:
+                    out.write(text)
+                    out.flush()
+
+        # Drain on a timer so output followed by a quiet period is not held back
+        # until the next chunk arrives
+        def flush_periodically() -> None:
+            while not done.wait(_LOG_FLUSH_INTERVAL):
+                flush()
+
+        flusher = threading.Thread(target=flush_periodically, daemon=True)
+        flusher.start()
+        try:
+            for chunk in logs:
+                with lock:
+                    buffer += chunk
+                    full = len(buffer) >= _LOG_BUFFER_SIZE
+                if full:
+                    flush()
+        finally:
+            done.set()
+            flusher.join()
+            flush(final=True)
+
+    def _get_cache_sources(self, name: str, version: str) -> List[str]:
+        """Collect local images whose layers can seed the build cache."""
+        if self._find_image_file(name, version) is not None:
+            self._load_image(name, version)
+
+        cache_sources = []
+        try:
+            for image in self._client.images.list(filters={"reference": f"{self.image_prefix}/{self._lang}-*"}):
+                cache_sources.extend(image.tags)
+        except DockerException:
+            pass
+
+        return cache_sources
+
+    def _build_image(
+            self,
+            image_name: str,
+            dockerfile: str,
+            context_files: Dict[str, str],
+            cache_from: List[str],
+            build_stage: bool = False
+    ) -> None:
+        """Build an image from an in-memory context holding only the Dockerfile and the files it copies."""
+        context = io.BytesIO()
+        with tarfile.open(fileobj=context, mode="w", dereference=True) as tar:
+            dockerfile_bytes = dockerfile.encode()
+            dockerfile_info = tarfile.TarInfo("Dockerfile")
+            dockerfile_info.size = len(dockerfile_bytes)
+            tar.addfile(dockerfile_info, io.BytesIO(dockerfile_bytes))
+
+            for arcname, host_path in context_files.items():
+                tar.add(host_path, arcname=arcname)
+
+        if build_stage:
+            # The classic builder only reuses layers that are ancestors of a cache_from
+            # image, and the build stage never is one of the final image; tag it on
+            # its own so unchanged dependency installs stay cached
+            cache_tag = f"{image_name}-cache"
+            cache_from = list(dict.fromkeys([*cache_from, cache_tag]))
+            context.seek(0)
+            self._client.images.build(
+                fileobj=context,
+                custom_context=True,
+                tag=cache_tag,
+                target=_BUILD_STAGE,
+                rm=True,
+                cache_from=cache_from
+            )
+
+        context.seek(0)
+        self._client.images.build(
+            fileobj=context,
+            custom_context=True,
+            tag=image_name,
+            rm=True,
+            cache_from=cache_from
+        )
+
     @abstractmethod
     def create_environment(
             self,
@@ -82,7 +436,7 @@ class EnvironmentManager(ABC):
         pass
 
     def activate_environment(self, name: str, lang: str) -> bool | None:
-        """Activate and enter an environment with language specificity."""
+        """Activate and enter an environment, replacing this process with its shell."""
         if not name:
             raise ValueError("Environment name is required")
         if not lang:
@@ -90,16 +444,17 @@ class EnvironmentManager(ABC):
 
         self._lang = lang
 
-        env_files = list(self._base_dir.glob(f"{self._lang}-{name}-*.tar"))
-        if not env_files:
+        envs = self._find_environments(name, self._lang)
+        if not envs:
             self._console.print(f"[red]Error: {self._lang.capitalize()} environment '{name}' does not exist[/red]")
             return False
 
-        version = env_files[0].stem.split('-')[-1]
+        version = envs[0]['version']
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
 
+        image = None
         try:
-            self._client.images.get(image_name)
+            image = self._client.images.get(image_name)
             self._console.print(f"[green]Using local image: {image_name}[/green]")
         except DockerException:
             self._console.print(f"[red]Local image '{image_name}' not found. Aborting.[/red]")
@@ -110,99 +465,99 @@ class EnvironmentManager(ABC):
                 self._console.print(f"[red]Failed to load image from .tar for '{name}'[/red]")
                 return False
 
+        container = None
         try:
+            if image is None:
+                image = self._client.images.get(image_name)
+
+            # Images built before the shell label existed fall back to POSIX sh
+            shell = image.labels.get("kosher.shell")
+            if shell is None:
+                self._console.print("[yellow]No shell recorded for this image, using /bin/sh[/yellow]")
+                shell = "/bin/sh"
+
             self._console.print(f"[cyan]Starting {self._lang.capitalize()} environment: {name}[/cyan]")
 
-            container = self._client.containers.run(
+            container = self._client.containers.create(
                 image_name,
-                command="tail -f /dev/null",
+                command=shell,
                 volumes={
                     os.getcwd(): {
                         'bind': self._container_dir,
                         'mode': 'rw'
                     }
                 },
-                detach=True,
                 tty=True,
                 stdin_open=True,
-                remove=True
+                init=True,
+                auto_remove=True
             )
 
-            exec_result = container.exec_run("test -x /bin/bash", demux=True)
-            shell = "/bin/bash" if exec_result.exit_code == 0 else "/bin/sh"
-
-            if shell == "/bin/sh":
-                self._console.print("[yellow]/bin/bash not found, using /bin/sh[/yellow]")
-
-            subprocess.run(["docker", "exec", "-it", container.id, shell])
-
-            return True
+            # Hand the terminal to the docker CLI; the shell is the container's main
+            # process, so the container exits and is removed when the shell does
+            os.execvp("docker", ["docker", "start", "--attach", "--interactive", container.id])
 
         except DockerException as e:
             self._console.print(f"[red]Error activating environment: {str(e)}[/red]")
             return False
+        except OSError as e:
+            self._console.print(f"[red]Error attaching to environment: {str(e)}[/red]")
+            return False
         except KeyboardInterrupt:
             self._console.print("\n[yellow]Environment activation interrupted[/yellow]")
             return False
         finally:
-            try:
-                self._client.images.remove(image_name)
-                self._console.print("[dim]Cleaned up environment resources[/dim]")
-            except DockerException:
-                pass
+            # Only reached when the hand-off to the docker CLI did not happen; the
+            # image is kept so later builds and activations reuse its layers
+            if container is not None:
+                try:
+                    container.remove(force=True)
+                    self._console.print("[dim]Cleaned up environment resources[/dim]")
+                except DockerException:
+                    pass
 
     def list_environments(self, lang: Optional[str] = None) -> List[Dict[str, str]]:
         """List all available environments with language, name, and version."""
-        environments = []
+        return [
+            dict(entry) for entry in self._read_manifest().values()
+            if lang is None or entry['lang'] == lang
+        ]
 
-        for file in self._base_dir.glob("*.tar"):
-            try:
-                file_name = file.stem
-                parts = file_name.split('-')
-
-                if len(parts) >= 3:
-                    file_lang = parts[0]
-                    version = parts[-1]
-                    name = '-'.join(parts[1:-1])
-
-                    if lang is None or file_lang == lang:
-                        environments.append({
-                            'lang': file_lang,
-                            'name': name,
-                            'version': version,
-                            'file': file.name
-                        })
-            except Exception as e:
-                self._console.print(f"[red]Error parsing file {file.name}: {str(e)}[/red]")
-
-        return environments
-
-    def delete_environment(self, name: str, lang: str) -> bool:
+    def delete_environment(self, name: str, lang: str, version: Optional[str] = None) -> bool:
         """Delete an environment with enforced language specification."""
         if not name:
             raise ValueError("Environment name is required")
         if not lang:
             raise ValueError("Language is required for deletion")
 
-        # Locate environment tar files matching the language and name
-        env_files = list(self._base_dir.glob(f"{lang}-{name}-*.tar"))
-        if not env_files:
+        # Locate the environment files matching the language, name and version;
+        # without a version the first saved one is deleted
+        envs = self._find_environments(name, lang)
+        if envs and version is None:
+            version = envs[0]['version']
+        envs = [env for env in envs if env['version'] == version]
+        if not envs:
             self._console.print(f"[red]Error: Environment '{name}' for language '{lang}' does not exist[/red]")
             return False
 
-        # Extract version from the tar file name
-        version = env_files[0].stem.split('-')[-1]
-        image_name = f"{self.image_prefix}/{lang}-{name}:{version}"
-
         try:
-            # Delete local tar file
-            env_files[0].unlink()
+            # Delete local tar files (compressed and legacy) and drop them from the index
+            for env in envs:
+                (self._base_dir / env['file']).unlink(missing_ok=True)
+            self._resync_manifest()
             self._console.print(f"[green]Successfully deleted environment tar for '{name}'[/green]")
 
             # Remove the Docker image
+            image_name = f"{self.image_prefix}/{lang}-{name}:{version}"
             self._client.images.remove(image=image_name, force=True)
             self._console.print(f"[green]Successfully removed Docker image: {image_name}[/green]")
 
+            # Drop the build-stage cache tag, if this environment had one
+            try:
+                self._client.images.remove(image=f"{image_name}-cache", force=True)
+            except ImageNotFound:
+                pass
+
             return True
 
         except DockerException as e:
@@ -1,11 +1,52 @@
 import os
-from pathlib import Path
-from typing import Optional, Any, List
+from typing import Optional, Any, Dict
 
 from docker.errors import DockerException
 
 from .container import EnvironmentManager
 
+_NODE_TOOLCHAIN = "RUN npm install -g npm@latest && npm cache clean --force\n"
+
+_NODE_TMPL_NOREQ = (
+    "FROM node:{v}-slim\n"
+    "LABEL kosher.shell=/bin/bash\n"
+    "WORKDIR {d}\n"
+    + _NODE_TOOLCHAIN
+)
+
+# Build stage: install dependencies, keeping only node_modules for the
+# runtime image
+_NODE_BUILD_STAGE = (
+    "FROM node:{v}-slim AS build\n"
+    "WORKDIR {d}\n"
+    + _NODE_TOOLCHAIN
+)
+
+# Runtime stage: node_modules sits in the parent of the container directory,
+# where module resolution still finds it but the source bind mount cannot
+# shadow it
+_NODE_RUNTIME_STAGE = (
+    "FROM node:{v}-slim\n"
+    "LABEL kosher.shell=/bin/bash\n"
+    "WORKDIR {d}\n"
+    "COPY --from=build {d}/node_modules /node_modules\n"
+    "ENV PATH=$PATH:/node_modules/.bin\n"
+)
+
+_NODE_TMPL_REQ = (
+    _NODE_BUILD_STAGE
+    + "COPY package.json .\n"
+    "RUN npm install && mkdir -p node_modules\n"
+    + _NODE_RUNTIME_STAGE
+)
+
+_NODE_TMPL_LOCK = (
+    _NODE_BUILD_STAGE
+    + "COPY package.json package-lock.json ./\n"
+    "RUN npm ci && mkdir -p node_modules\n"
+    + _NODE_RUNTIME_STAGE
+)
+
 
 class NodeEnvironmentManager(EnvironmentManager):
     """Environment manager for Node.js projects using Docker."""
@@ -30,7 +71,6 @@ class NodeEnvironmentManager(EnvironmentManager):
             raise ValueError("Environment name/version is required")
 
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
-        dockerfile_path = Path(f"{self._lang}-{name}.Dockerfile")
 
         try:
             # Check if image with the same name and version already exists
@@ -42,16 +82,17 @@ class NodeEnvironmentManager(EnvironmentManager):
                 pass
 
             # Create Node.js-specific Dockerfile
-            dockerfile_content = self._generate_dockerfile(version, requirements)
-            dockerfile_path.write_text("\n".join(dockerfile_content))
+            context_files = self._get_context_files(requirements)
+            dockerfile_content = self._generate_dockerfile(version, context_files)
 
             # Build the Docker image
             self._console.print(f"[cyan]Building Node.js environment: {name}:{version}[/cyan]")
-            self._client.images.build(
-                path=".",
-                dockerfile=str(dockerfile_path),
-                tag=image_name,
-                rm=True
+            self._build_image(
+                image_name,
+                dockerfile_content,
+                context_files,
+                self._get_cache_sources(name, version),
+                build_stage=bool(context_files)
             )
 
             # Save the built image locally
@@ -65,31 +106,32 @@ class NodeEnvironmentManager(EnvironmentManager):
         except DockerException as e:
             self._console.print(f"[red]Error building image: {str(e)}[/red]")
             return False
-        finally:
-            dockerfile_path.unlink(missing_ok=True)
 
-    def _generate_dockerfile(self, version: str, requirements: Optional[str]) -> List[str]:
-        """Generate Dockerfile contents for Node.js environment."""
-        dockerfile_content = [
-            f"FROM node:{version}-slim",
-            f"WORKDIR {self._container_dir}",
-            "RUN npm install -g npm@latest",
-        ]
+    def _get_context_files(self, requirements: Optional[str]) -> Dict[str, str]:
+        """Map build context names to the host files the Dockerfile copies."""
+        if not requirements:
+            return {}
 
-        if requirements:
-            # Ensure requirements is relative to the build context
-            req_filename = os.path.basename(requirements)
+        if not os.path.exists(requirements):
+            raise FileNotFoundError(f"package.json not found: {requirements}")
 
-            if not os.path.exists(requirements):
-                raise FileNotFoundError(f"package.json not found: {requirements}")
+        context_files = {"package.json": requirements}
 
-            dockerfile_content.extend([
-                f"COPY {req_filename} .",
-                "RUN npm install",
-                "ENV PATH=$PATH:./node_modules/.bin",
-            ])
+        # Copy only the manifest and lockfile so the install layer stays cached
+        # until the dependencies themselves change
+        lockfile = os.path.join(os.path.dirname(requirements), "package-lock.json")
+        if os.path.exists(lockfile):
+            context_files["package-lock.json"] = lockfile
 
-        return dockerfile_content
+        return context_files
+
+    def _generate_dockerfile(self, version: str, context_files: Dict[str, str]) -> str:
+        """Generate Dockerfile contents for Node.js environment."""
+        if not context_files:
+            return _NODE_TMPL_NOREQ.format(v=version, d=self._container_dir)
+
+        template = _NODE_TMPL_LOCK if "package-lock.json" in context_files else _NODE_TMPL_REQ
+        return template.format(v=version, d=self._container_dir)
 
     def build_source(self, name: str, version: str, **kwargs: Any) -> bool:
         """Build Node.js source code inside the environment."""
@@ -111,9 +153,7 @@ class NodeEnvironmentManager(EnvironmentManager):
                 stream=True
             )
 
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             self._console.print(f"[green]Successfully built Node.js project in '{name}:{version}'[/green]")
             return True
@@ -128,7 +168,8 @@ class NodeEnvironmentManager(EnvironmentManager):
     def run_code(self, name: str, version: str, code_path: str, **kwargs: Any) -> bool:
         """Run a Node.js script inside the environment container."""
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
-        source_dir = os.path.abspath(os.path.dirname(code_path))
+        # The script is only executed, so its directory is mounted read-only
+        source_dir = os.path.realpath(os.path.dirname(os.fspath(code_path)))
         script_name = os.path.basename(code_path)
 
         try:
@@ -139,16 +180,14 @@ class NodeEnvironmentManager(EnvironmentManager):
                 volumes={
                     source_dir: {
                         'bind': self._container_dir,
-                        'mode': 'rw'
+                        'mode': 'ro'
                     }
                 },
                 remove=True,
                 stream=True
             )
 
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             self._console.print(f"[green]Successfully ran {script_name}[/green]")
             return True
@@ -1,11 +1,25 @@
 import os
 from pathlib import Path
-from typing import Optional, Any, List
+from typing import Optional, Any, Dict
 
 from docker.errors import DockerException
 
 from .container import EnvironmentManager
 
+_PYTHON_TMPL_NOREQ = (
+    "FROM python:{v}-slim\n"
+    "LABEL kosher.shell=/bin/bash\n"
+    "RUN apt-get update && apt-get install -y build-essential\n"
+    "WORKDIR {d}\n"
+    "RUN pip install --upgrade pip\n"
+)
+
+_PYTHON_TMPL_REQ = (
+    _PYTHON_TMPL_NOREQ
+    + "COPY requirements.txt .\n"
+    "RUN pip install -r requirements.txt\n"
+)
+
 
 class PythonEnvironmentManager(EnvironmentManager):
     """Environment manager for Python projects using Docker."""
@@ -30,7 +44,6 @@ class PythonEnvironmentManager(EnvironmentManager):
             raise ValueError("Environment name/version is required")
 
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
-        dockerfile_path = Path(f"{self._lang}-{name}.Dockerfile")
 
         try:
             # Check if image with the same name and version already exists
@@ -42,16 +55,16 @@ class PythonEnvironmentManager(EnvironmentManager):
                 pass
 
             # Create Python-specific Dockerfile
-            dockerfile_content = self._generate_dockerfile(version, requirements)
-            dockerfile_path.write_text("\n".join(dockerfile_content))
+            context_files = self._get_context_files(requirements)
+            dockerfile_content = self._generate_dockerfile(version, context_files)
 
             # Build the Docker image
             self._console.print(f"[cyan]Building Python environment: {name}:{version}[/cyan]")
-            self._client.images.build(
-                path=".",
-                dockerfile=str(dockerfile_path),
-                tag=image_name,
-                rm=True
+            self._build_image(
+                image_name,
+                dockerfile_content,
+                context_files,
+                self._get_cache_sources(name, version)
             )
 
             # Save the built image locally
@@ -65,27 +78,20 @@ class PythonEnvironmentManager(EnvironmentManager):
         except DockerException as e:
             self._console.print(f"[red]Error building image: {str(e)}[/red]")
             return False
-        finally:
-            dockerfile_path.unlink(missing_ok=True)
 
-    def _generate_dockerfile(self, version: str, requirements: Optional[str]) -> List[str]:
+    def _get_context_files(self, requirements: Optional[str]) -> Dict[str, str]:
+        """Map build context names to the host files the Dockerfile copies."""
+        if not requirements:
+            return {}
+
+        if not os.path.exists(requirements):
+            raise FileNotFoundError(f"requirements.txt not found: {requirements}")
+        return {"requirements.txt": requirements}
+
+    def _generate_dockerfile(self, version: str, context_files: Dict[str, str]) -> str:
         """Generate Dockerfile contents for Python environment."""
-        dockerfile_content = [
-            f"FROM python:{version}-slim",
-            "RUN apt-get update && apt-get install -y build-essential",
-            f"WORKDIR {self._container_dir}",
-            "RUN pip install --upgrade pip"
-        ]
-
-        if requirements:
-            if not os.path.exists(requirements):
-                raise FileNotFoundError(f"requirements.txt not found: {requirements}")
-            dockerfile_content.extend([
-                f"COPY {requirements} .",
-                "RUN pip install -r requirements.txt"
-            ])
-
-        return dockerfile_content
+        template = _PYTHON_TMPL_REQ if context_files else _PYTHON_TMPL_NOREQ
+        return template.format(v=version, d=self._container_dir)
 
     def build_source(self, name: str, version: str, **kwargs: Any) -> bool:
         """Build Python source code into executable using PyInstaller."""
@@ -118,9 +124,7 @@ class PythonEnvironmentManager(EnvironmentManager):
             )
 
             # Stream build logs
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             # Verify build success
             built_executable = Path(output_dir) / "main"
@@ -159,9 +163,7 @@ class PythonEnvironmentManager(EnvironmentManager):
                 stream=True
             )
 
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             self._console.print(f"[green]Successfully ran {script_name}[/green]")
             return True
@@ -1,11 +1,55 @@
 import os
-from pathlib import Path
-from typing import Optional, Any, List
+from typing import Optional, Any, Dict
 
 from docker.errors import DockerException
 
 from .container import EnvironmentManager
 
+_RUBY_TOOLCHAIN = (
+    "RUN apt-get update && apt-get install -y build-essential libpq-dev"
+    " && gem install bundler && rm -rf /var/lib/apt/lists/*\n"
+)
+
+_RUBY_TMPL_NOREQ = (
+    "FROM ruby:{v}-slim\n"
+    "LABEL kosher.shell=/bin/bash\n"
+    "WORKDIR {d}\n"
+    + _RUBY_TOOLCHAIN
+)
+
+# Build stage: compile gems with the toolchain, keeping only the installed
+# bundle for the runtime image
+_RUBY_BUILD_STAGE = (
+    "FROM ruby:{v}-slim AS build\n"
+    "WORKDIR {d}\n"
+    + _RUBY_TOOLCHAIN
+)
+
+# Runtime stage: gems live in GEM_HOME (/usr/local/bundle), outside the
+# bind-mounted container directory
+_RUBY_RUNTIME_STAGE = (
+    "FROM ruby:{v}-slim\n"
+    "LABEL kosher.shell=/bin/bash\n"
+    "WORKDIR {d}\n"
+    "RUN apt-get update && apt-get install -y --no-install-recommends libpq5"
+    " && rm -rf /var/lib/apt/lists/*\n"
+    "COPY --from=build /usr/local/bundle /usr/local/bundle\n"
+)
+
+_RUBY_TMPL_REQ = (
+    _RUBY_BUILD_STAGE
+    + "COPY Gemfile ./Gemfile\n"
+    "RUN bundle install && rm -rf /usr/local/bundle/cache\n"
+    + _RUBY_RUNTIME_STAGE
+)
+
+_RUBY_TMPL_LOCK = (
+    _RUBY_BUILD_STAGE
+    + "COPY Gemfile Gemfile.lock ./\n"
+    "RUN BUNDLE_FROZEN=true bundle install && rm -rf /usr/local/bundle/cache\n"
+    + _RUBY_RUNTIME_STAGE
+)
+
 
 class RubyEnvironmentManager(EnvironmentManager):
     """Environment manager for Ruby projects using Docker."""
@@ -30,7 +74,6 @@ class RubyEnvironmentManager(EnvironmentManager):
             raise ValueError("Environment name/version is required")
 
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
-        dockerfile_path = Path(f"{self._lang}-{name}.Dockerfile")
 
         try:
             # Check if image with the same name and version already exists
@@ -42,16 +85,17 @@ class RubyEnvironmentManager(EnvironmentManager):
                 pass
 
             # Create Ruby-specific Dockerfile
-            dockerfile_content = self._generate_dockerfile(version, requirements)
-            dockerfile_path.write_text("\n".join(dockerfile_content))
+            context_files = self._get_context_files(requirements)
+            dockerfile_content = self._generate_dockerfile(version, context_files)
 
             # Build the Docker image
             self._console.print(f"[cyan]Building Ruby environment: {name}:{version}[/cyan]")
-            self._client.images.build(
-                path=".",
-                dockerfile=str(dockerfile_path),
-                tag=image_name,
-                rm=True
+            self._build_image(
+                image_name,
+                dockerfile_content,
+                context_files,
+                self._get_cache_sources(name, version),
+                build_stage=bool(context_files)
             )
 
             # Save the built image locally
@@ -65,27 +109,32 @@ class RubyEnvironmentManager(EnvironmentManager):
         except DockerException as e:
             self._console.print(f"[red]Error building image: {str(e)}[/red]")
             return False
-        finally:
-            dockerfile_path.unlink(missing_ok=True)
 
-    def _generate_dockerfile(self, version: str, requirements: Optional[str]) -> List[str]:
+    def _get_context_files(self, requirements: Optional[str]) -> Dict[str, str]:
+        """Map build context names to the host files the Dockerfile copies."""
+        if not requirements:
+            return {}
+
+        if not os.path.exists(requirements):
+            raise FileNotFoundError(f"Gemfile not found: {requirements}")
+
+        context_files = {"Gemfile": requirements}
+
+        # Copy only the manifest and lockfile so the install layer stays cached
+        # until the dependencies themselves change
+        lockfile = os.path.join(os.path.dirname(requirements), "Gemfile.lock")
+        if os.path.exists(lockfile):
+            context_files["Gemfile.lock"] = lockfile
+
+        return context_files
+
+    def _generate_dockerfile(self, version: str, context_files: Dict[str, str]) -> str:
         """Generate Dockerfile contents for Ruby environment."""
-        dockerfile_content = [
-            f"FROM ruby:{version}-slim",
-            f"WORKDIR {self._container_dir}",
-            "RUN apt-get update && apt-get install -y build-essential libpq-dev",
-            "RUN gem install bundler"
-        ]
-
-        if requirements:
-            if not os.path.exists(requirements):
-                raise FileNotFoundError(f"Gemfile not found: {requirements}")
-            dockerfile_content.extend([
-                f"COPY {requirements} ./Gemfile",
-                "RUN bundle install"
-            ])
-
-        return dockerfile_content
+        if not context_files:
+            return _RUBY_TMPL_NOREQ.format(v=version, d=self._container_dir)
+
+        template = _RUBY_TMPL_LOCK if "Gemfile.lock" in context_files else _RUBY_TMPL_REQ
+        return template.format(v=version, d=self._container_dir)
 
     def build_source(self, name: str, version: str, **kwargs: Any) -> bool:
         """Build Ruby source code inside the environment."""
@@ -107,9 +156,7 @@ class RubyEnvironmentManager(EnvironmentManager):
                 stream=True
             )
 
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             self._console.print(f"[green]Successfully built Ruby project in '{name}:{version}'[/green]")
             return True
@@ -124,7 +171,8 @@ class RubyEnvironmentManager(EnvironmentManager):
     def run_code(self, name: str, version: str, code_path: str, **kwargs: Any) -> bool:
         """Run a Ruby script inside the environment container."""
         image_name = f"{self.image_prefix}/{self._lang}-{name}:{version}"
-        source_dir = os.path.abspath(os.path.dirname(code_path))
+        # The script is only executed, so its directory is mounted read-only
+        source_dir = os.path.realpath(os.path.dirname(os.fspath(code_path)))
         script_name = os.path.basename(code_path)
 
         try:
@@ -135,16 +183,14 @@ class RubyEnvironmentManager(EnvironmentManager):
                 volumes={
                     source_dir: {
                         'bind': self._container_dir,
-                        'mode': 'rw'
+                        'mode': 'ro'
                     }
                 },
                 remove=True,
                 stream=True
             )
 
-            for log in container:
-                if log:
-                    self._console.print(log.decode().strip())
+            self._stream_logs(container)
 
             self._console.print(f"[green]Successfully ran {script_name}[/green]")
             return True
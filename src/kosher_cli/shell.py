@@ -44,7 +44,8 @@ class ShellPrompt:
         )
         self._parser.add_argument(
             "-v", "--version",
-            help="Language version (e.g., '3.12' for Python, '20' for Node, '3.3' for Ruby)"
+            help="Language version (e.g., '3.12' for Python, '20' for Node, '3.3' for Ruby); "
+                 "for 'delete', the environment version to remove (default: first saved)"
         )
         self._parser.add_argument(
             "-r", "--requirements",
@@ -101,7 +102,7 @@ class ShellPrompt:
                             "[yellow]No environments found. Create one using the 'create' command.[/yellow]"
                         )
                 case "delete":
-                    manager.delete_environment(args.name, args.lang)
+                    manager.delete_environment(args.name, args.lang, args.version)
                 case "run":
                     if not args.code:
                         self._console.print("[red]Error: --code (-c) argument is required for 'run' command[/red]")